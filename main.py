@@ -1,253 +1,471 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-import shutil
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi.responses import JSONResponse
+import asyncio
+import hashlib
+import io
 import os
 import tempfile
+import threading
+from collections import OrderedDict
 import librosa
+import soundfile as sf
+import numba
 import numpy as np
+import orjson
 import scipy.ndimage
+from types import MappingProxyType
 
-app = FastAPI()
+class _ORJSONResponse(JSONResponse):
+    # orjson is several times faster than the stdlib json module on large segment lists.
+    # Endpoints return this response directly, which also skips FastAPI's
+    # jsonable_encoder pass; payloads are already plain Python values
+    def render(self, content):
+        return orjson.dumps(content)
+
+app = FastAPI(default_response_class=_ORJSONResponse)
+
+# Krumhansl-Schmuckler key profiles
+# C, C#, D, D#, E, F, F#, G, G#, A, A#, B
+_PITCHES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+_MAJOR = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+_MINOR = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+def _normalized_circulant(profile):
+    # Row i is the profile rolled to root note i, centered and scaled to unit length
+    # so a dot product with a centered, unit-length chroma vector is the Pearson correlation
+    circ = np.stack([np.roll(profile, i) for i in range(12)])
+    circ = circ - circ.mean(axis=1, keepdims=True)
+    # Stored as float32 to match the chroma it's multiplied with
+    return (circ / np.linalg.norm(circ, axis=1, keepdims=True)).astype(np.float32)
+
+_MAJOR_CIRC_N = _normalized_circulant(_MAJOR)
+_MINOR_CIRC_N = _normalized_circulant(_MINOR)
+_KEY_NAMES = tuple(f"{p} Major" for p in _PITCHES) + tuple(f"{p} Minor" for p in _PITCHES)
+
+for _arr in (_MAJOR, _MINOR, _MAJOR_CIRC_N, _MINOR_CIRC_N):
+    _arr.setflags(write=False)
+
+# Structure analysis always runs at 22050 Hz with a 2048-point STFT and a hop of
+# 512 (~43 frames per second)
+_SR = 22050
+_N_FFT = 2048
+_HOP = 512
+# Bins below 200Hz are a contiguous prefix of the spectrum, so slice instead of masking
+_BASS_BINS = int(np.ceil(200 * _N_FFT / _SR))
+
+# Standard Camelot Wheel Mapping
+_CAMELOT = MappingProxyType({
+    # B Major / Ab Minor (5 Sharps / 7 Flats) -> 1
+    'B Major': '1B', 'G# Minor': '1A', 'Ab Minor': '1A',
+    
+    # F# Major / Eb Minor (6 Sharps / 6 Flats) -> 2
+    'F# Major': '2B', 'Gb Major': '2B', 'D# Minor': '2A', 'Eb Minor': '2A',
+    
+    # Db Major / Bb Minor (5 Flats / 7 Sharps) -> 3
+    'C# Major': '3B', 'Db Major': '3B', 'A# Minor': '3A', 'Bb Minor': '3A',
+    
+    # Ab Major / F Minor (4 Flats) -> 4
+    'G# Major': '4B', 'Ab Major': '4B', 'F Minor': '4A',
+    
+    # Eb Major / C Minor (3 Flats) -> 5
+    'D# Major': '5B', 'Eb Major': '5B', 'C Minor': '5A',
+    
+    # Bb Major / G Minor (2 Flats) -> 6
+    'A# Major': '6B', 'Bb Major': '6B', 'G Minor': '6A',
+    
+    # F Major / D Minor (1 Flat) -> 7
+    'F Major': '7B', 'D Minor': '7A',
+    
+    # C Major / A Minor (No Sharps/Flats) -> 8
+    'C Major': '8B', 'A Minor': '8A',
+    
+    # G Major / E Minor (1 Sharp) -> 9
+    'G Major': '9B', 'E Minor': '9A',
+    
+    # D Major / B Minor (2 Sharps) -> 10
+    'D Major': '10B', 'B Minor': '10A',
+    
+    # A Major / F# Minor (3 Sharps) -> 11
+    'A Major': '11B', 'F# Minor': '11A', 'Gb Minor': '11A',
+    
+    # E Major / C# Minor (4 Sharps) -> 12
+    'E Major': '12B', 'C# Minor': '12A', 'Db Minor': '12A'
+})
+
+# In-process LRU caches keyed on a hash of the uploaded bytes, so re-uploading
+# the same track skips the analysis. Results are small and capped by count.
+# Decoded waveforms are only shared when load arguments match (today that's
+# /analyze-structure and /analyze), and a 10-minute track is ~53 MB, so that
+# cache is capped by total waveform size instead.
+_RESULT_CACHE_SIZE = 256
+_AUDIO_CACHE_BYTES = 128 * 1024 * 1024
+
+class _LRUCache:
+    # Least recently used cache bounded by the total weight of its entries
+    # (entry count by default). The running total keeps get/put O(1) under the lock
+    def __init__(self, max_weight, weight=lambda value: 1):
+        self._max_weight = max_weight
+        self._weight = weight
+        self._entries = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        w = self._weight(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= old[1]
+            self._entries[key] = (value, w)
+            self._total += w
+            while self._entries and self._total > self._max_weight:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._total -= evicted
+
+_result_cache = _LRUCache(_RESULT_CACHE_SIZE)
+_audio_cache = _LRUCache(_AUDIO_CACHE_BYTES, weight=lambda audio: audio[0].nbytes)
+
+def _content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _decode_audio(data, suffix, **kwargs):
+    # Decode straight from memory when soundfile understands the format
+    try:
+        return librosa.load(io.BytesIO(data), **kwargs)
+    except sf.SoundFileRuntimeError:
+        # Otherwise librosa needs a file path so it can fall back to audioread
+        # This runs in a worker thread, so the write doesn't block the event loop,
+        # and the bytes are already in memory so they go out in a single write
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+            temp_file.write(data)
+            temp_path = temp_file.name
+        try:
+            return librosa.load(temp_path, **kwargs)
+        finally:
+            os.remove(temp_path)
+
+def _load_audio(data, suffix, digest, **kwargs):
+    key = (digest, tuple(sorted(kwargs.items())))
+    audio = _audio_cache.get(key)
+    if audio is None:
+        y, sr = _decode_audio(data, suffix, **kwargs)
+        # Everything downstream runs in single precision; make sure it starts there
+        audio = (y.astype(np.float32, copy=False), sr)
+        _audio_cache.put(key, audio)
+    return audio
+
+async def _run_cached(analyze, data, suffix, **params):
+    # Hash once per upload and reuse it for both the result and waveform caches
+    digest = await asyncio.to_thread(_content_hash, data)
+    key = (analyze.__name__, digest, tuple(sorted(params.items())))
+    result = _result_cache.get(key)
+    if result is None:
+        result = await asyncio.to_thread(analyze, data, suffix, digest, **params)
+        _result_cache.put(key, result)
+    return result
+
+@numba.njit(cache=True)
+def _thin_change_points(change_points, min_gap):
+    # Keep a change point only if it's more than min_gap after the last one kept
+    out = np.empty_like(change_points)
+    n = 0
+    last = -np.inf
+    for cp in change_points:
+        if cp - last > min_gap:
+            out[n] = cp
+            n += 1
+            last = cp
+    return out[:n]
+
+@numba.njit(cache=True)
+def _bass_change_frames(bass_norm, threshold):
+    # Frames i where |bass_norm[i + 1] - bass_norm[i]| > threshold, in one pass
+    # without materializing the diff and abs arrays
+    out = np.empty(max(bass_norm.size - 1, 0), np.int64)
+    n = 0
+    for i in range(bass_norm.size - 1):
+        if abs(bass_norm[i + 1] - bass_norm[i]) > threshold:
+            out[n] = i
+            n += 1
+    return out[:n]
+
+# Compile now so the first request doesn't pay the JIT cost
+_thin_change_points(np.zeros(1), 10.0)
+_bass_change_frames(np.zeros(2, dtype=np.float32), 0.3)
 
 @app.get("/health")
 def read_root():
     return {"Status": "OK"}
 
-@app.post("/analyze-bpm-librosa")
-async def analyze_bpm(file: UploadFile = File(...)):
+# The analysis functions below are plain synchronous code.
+# The endpoints run them through _run_cached, which uses asyncio.to_thread so the
+# CPU-heavy librosa work doesn't block the event loop (numpy/librosa release the
+# GIL in native code).
+
+def _key_from_chroma(chroma):
+    # Krumhansl-Schmuckler key detection on the mean chroma vector
+    chroma_mean = np.mean(chroma, axis=1, dtype=np.float32)
+    cm = chroma_mean - chroma_mean.mean()
+    cm /= np.linalg.norm(cm)
+
+    # Correlation against all 12 major and 12 minor keys in two matmuls
+    key_correlations = np.concatenate([_MAJOR_CIRC_N @ cm, _MINOR_CIRC_N @ cm])
+    best_key = _KEY_NAMES[int(np.argmax(key_correlations))]
+
+    # Convert to Camelot Wheel
+    camelot_code = _CAMELOT.get(best_key, "Unknown")
+
+    return {
+        "detected_key": best_key,
+        "camelot_code": camelot_code
+    }
+
+def _structure_from_spectrogram(S, duration):
+    # S is the magnitude STFT at _SR/_N_FFT/_HOP; every structure feature below is derived from it
+    # 1. Calculate RMS Energy (Loudness) and Spectral Contrast (Bass vs Treble)
+    # Calculate Root Mean Square energy (overall volume)
+    rms = librosa.feature.rms(S=S, frame_length=_N_FFT, hop_length=_HOP)[0]
     
-    # Create a temporary file to save the uploaded audio
-    # librosa needs a file path to load effectively
-    suffix = os.path.splitext(file.filename)[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_path = temp_file.name
+    # Calculate Low-Frequency Energy (Bass)
+    # Sum energy below 200Hz
+    bass_energy = np.sum(S[:_BASS_BINS, :], axis=0)
 
-    try:
-        # Load the audio file
-        # y is raw audio waveform, sr is the sampling rate
-        y, sr = librosa.load(temp_path)
+    # Smooth the signals to remove jitter (like short drum hits)
+    # We use a median filter over ~1 second (43 frames)
+    # A moving average is cheaper but lets isolated kicks pull the bass level up,
+    # which changes the labels; the 1-D median is already well under 1 ms per track
+    smoothing_window = 43 
+    bass_smooth = scipy.ndimage.median_filter(bass_energy, size=smoothing_window)
+    rms_smooth = scipy.ndimage.median_filter(rms, size=smoothing_window)
+    
+    # Normalize signals to 0-1 range for easier thresholding
+    bass_norm = librosa.util.normalize(bass_smooth)
+    rms_norm = librosa.util.normalize(rms_smooth)
+
+    # 2. Detect "Drop" and "Breakdown" events
+    # Logic: 
+    # - High Bass + High RMS = Drop / Main Chorus
+    # - Low Bass + Medium/High RMS = Intro / Breakdown / Build-up
+    
+    # Create segments (simplified for response)
+    # We classify every 1 second chunk
+    # Sample every 5 seconds to reduce output size
+    sample_rate_sec = 5
+    seg_times = np.arange(0, int(duration), sample_rate_sec)
+    # Find frame index for each sample time
+    idxs = librosa.time_to_frames(seg_times, sr=_SR, hop_length=_HOP)
+    keep = idxs < len(bass_norm)
+    seg_times, idxs = seg_times[keep], idxs[keep]
+    
+    b_vals = bass_norm[idxs]
+    r_vals = rms_norm[idxs]
+    
+    labels = np.select(
+        [
+            b_vals > 0.6,
+            (b_vals < 0.3) & (r_vals > 0.3),
+            (b_vals < 0.2) & (r_vals < 0.2),
+        ],
+        [
+            "High Energy (Drop/Chorus)",
+            "Breakdown/Build",
+            "Quiet/Intro/Outro",
+        ],
+        default="Verse/Mid Energy",
+    )
+    
+    # Round in float64 so the JSON carries 0.73 rather than 0.7300000190734863
+    segments = [
+        {"time": t, "label": label, "bass_level": b, "energy_level": r}
+        for t, label, b, r in zip(
+            seg_times.tolist(),
+            labels.tolist(),
+            np.round(b_vals.astype(np.float64), 2).tolist(),
+            np.round(r_vals.astype(np.float64), 2).tolist(),
+        )
+    ]
+
+    # 3. Find structural boundaries (Mix Points)
+    # Look for sudden large changes in bass energy
+    # Find frames where the derivative (rate of change) jumps sharply
+    change_points_frames = _bass_change_frames(bass_norm, 0.3) # Threshold 0.3 implies 30% jump
+    change_points_times = librosa.frames_to_time(change_points_frames, sr=_SR, hop_length=_HOP)
+    
+    # Filter changes that are too close together (keep only one every 10s)
+    filtered_changes = np.round(_thin_change_points(change_points_times, 10.0), 2).tolist()
+
+    return {
+        "duration_sec": round(float(duration), 2),
+        "mix_points_bass_change": filtered_changes,
+        "segments_5s_interval": segments
+    }
+
+def _analyze_bpm_sync(data, suffix, digest, sr, duration, start_bpm, use_hpss):
+    # Load the audio file
+    # y is raw audio waveform, sr is the sampling rate
+    # Tempo only needs a low sample rate and the first minute or so of the track
+    y, sr = _load_audio(data, suffix, digest, sr=sr, duration=duration, mono=True)
 
-        # 1. Separate Harmonic and Percussive components
-        # This isolates drums/transients from melody/vocals
-        # This is often more effective than raw low-pass filtering for beat tracking
+    # Scale the hop with the sample rate to keep ~43 onset frames per second,
+    # otherwise the tempo estimate gets noticeably coarser at low sample rates
+    hop_length = max(1, round(_HOP * sr / _SR))
+
+    # 1. Compute the onset strength envelope
+    if use_hpss:
+        # Separate Harmonic and Percussive components and track the PERCUSSIVE one
+        # This isolates drums/transients from melody/vocals, but HPSS is by far
+        # the most expensive step here
         _, y_percussive = librosa.effects.hpss(y)
+        onset_env = librosa.onset.onset_strength(y=y_percussive, sr=sr, hop_length=hop_length)
+    else:
+        # Median aggregation across frequency favours broadband transients (drums)
+        # and is usually as good as HPSS at a fraction of the cost
+        onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length, aggregate=np.median)
+
+    # 2. Run beat tracker on the onset envelope
+    # We also loosen the 'tightness' to allow it to deviate from start_bpm more easily
+    # Beat positions aren't returned, so skip trimming weak leading/trailing beats
+    tempo, _ = librosa.beat.beat_track(
+        onset_envelope=onset_env, sr=sr, hop_length=hop_length,
+        start_bpm=start_bpm, tightness=100, trim=False
+    )
+
+    # Handle return type (librosa returns a numpy array or scalar depending on version)
+    bpm = tempo[0] if isinstance(tempo, np.ndarray) else tempo
+
+    return {
+        "bpm": round(float(bpm), 2)
+    }
+
+def _analyze_key_sync(data, suffix, digest):
+    # Chroma only needs content up to ~5 kHz, so 11025 Hz is plenty
+    y, sr = _load_audio(data, suffix, digest, sr=11025)
+
+    # 1. Extract Chroma Features
+    # STFT chroma is much cheaper than CQT and good enough once it's mean-pooled
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr, n_fft=4096, hop_length=2048)
+    
+    # 2. Key Detection Logic (Krumhansl-Schmuckler)
+    return _key_from_chroma(chroma)
+
+def _analyze_structure_sync(data, suffix, digest):
+    # Load audio (downsample to 22050 for speed)
+    y, sr = _load_audio(data, suffix, digest, sr=_SR)
+
+    # Compute the STFT once and share its magnitude between all features
+    S = np.abs(librosa.stft(y, n_fft=_N_FFT, hop_length=_HOP, dtype=np.complex64))
+    duration = librosa.get_duration(y=y, sr=sr)
+    return _structure_from_spectrogram(S, duration)
+
+def _analyze_all_sync(data, suffix, digest, start_bpm, use_hpss):
+    # Decode once and compute a single complex STFT, then derive every feature
+    # from it instead of letting each analysis reload and re-transform the audio
+    y, sr = _load_audio(data, suffix, digest, sr=_SR)
+    D = librosa.stft(y, n_fft=_N_FFT, hop_length=_HOP, dtype=np.complex64)
+    S = np.abs(D)
+    duration = librosa.get_duration(y=y, sr=sr)
 
-        # 2. Run beat tracker on the PERCUSSIVE component
-        # We also loosen the 'tightness' to allow it to deviate from 120 more easily
-        tempo, _ = librosa.beat.beat_track(y=y_percussive, sr=sr, tightness=100)
+    # Tempo: onset strength from a log-mel spectrogram of the shared STFT
+    # (what onset_strength does from a waveform), optionally after HPSS on it
+    if use_hpss:
+        _, P = librosa.decompose.hpss(D)
+        mel = librosa.feature.melspectrogram(S=np.abs(P) ** 2, sr=sr)
+        onset_env = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=sr, hop_length=_HOP)
+    else:
+        mel = librosa.feature.melspectrogram(S=S ** 2, sr=sr)
+        onset_env = librosa.onset.onset_strength(
+            S=librosa.power_to_db(mel), sr=sr, hop_length=_HOP, aggregate=np.median
+        )
+    tempo, _ = librosa.beat.beat_track(
+        onset_envelope=onset_env, sr=sr, hop_length=_HOP,
+        start_bpm=start_bpm, tightness=100, trim=False
+    )
+    bpm = tempo[0] if isinstance(tempo, np.ndarray) else tempo
 
-        # Handle return type (librosa returns a numpy array or scalar depending on version)
-        bpm = tempo[0] if isinstance(tempo, np.ndarray) else tempo
+    # Key: chroma from the shared power spectrogram
+    chroma = librosa.feature.chroma_stft(S=S ** 2, sr=sr, n_fft=_N_FFT, hop_length=_HOP)
 
-        return {
-            "filename": file.filename,
-            "bpm": round(float(bpm), 2)
-        }
+    return {
+        "bpm": round(float(bpm), 2),
+        **_key_from_chroma(chroma),
+        **_structure_from_spectrogram(S, duration)
+    }
+
+@app.post("/analyze-bpm-librosa")
+async def analyze_bpm(
+    file: UploadFile = File(...),
+    # Capped at the structure analysis rate: higher rates cost memory without
+    # helping tempo, and past ~88 kHz the scaled hop outgrows the onset FFT.
+    # Below 8 kHz the onset envelope degrades into noise
+    sr: int = Query(11025, ge=8000, le=_SR),
+    # Seconds from the start of the track; up to 10 minutes for full-track BPM
+    duration: float = Query(60.0, gt=0, le=600.0),
+    start_bpm: float = Query(128.0, gt=0),
+    use_hpss: bool = False,
+):
+    
+    # Read the upload into memory and decode it without a disk round trip
+    suffix = os.path.splitext(file.filename)[1]
+    data = await file.read()
+
+    try:
+        result = await _run_cached(
+            _analyze_bpm_sync, data, suffix,
+            sr=sr, duration=duration, start_bpm=start_bpm, use_hpss=use_hpss
+        )
+        return _ORJSONResponse({"filename": file.filename, **result})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
-    
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
 
 @app.post("/analyze-key")
 async def analyze_key(file: UploadFile = File(...)):
-    # Create a temporary file to save the uploaded audio
     suffix = os.path.splitext(file.filename)[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_path = temp_file.name
+    data = await file.read()
 
     try:
-        y, sr = librosa.load(temp_path)
-
-        # 1. Extract Chroma Features
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-        
-        # 2. Key Detection Logic (Krumhansl-Schmuckler)
-        # Standard profiles for Major and Minor keys
-        # C, C#, D, D#, E, F, F#, G, G#, A, A#, B
-        major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
-        minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
-
-        chroma_mean = np.mean(chroma, axis=1)
-        
-        key_correlations = []
-        pitches = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        
-        # Calculate correlation for all 12 major and 12 minor keys
-        for i in range(12):
-            # Roll the profile to match the current root note
-            major_corr = np.corrcoef(chroma_mean, np.roll(major_profile, i))[0, 1]
-            minor_corr = np.corrcoef(chroma_mean, np.roll(minor_profile, i))[0, 1]
-            key_correlations.append((major_corr, f"{pitches[i]} Major"))
-            key_correlations.append((minor_corr, f"{pitches[i]} Minor"))
-
-        # Sort by correlation coefficient (descending)
-        key_correlations.sort(key=lambda x: x[0], reverse=True)
-        best_key = key_correlations[0][1]
-
-        # 3. Convert to Camelot Wheel
-        # Standard Camelot Wheel Mapping
-        camelot_mapping = {
-            # B Major / Ab Minor (5 Sharps / 7 Flats) -> 1
-            'B Major': '1B', 'G# Minor': '1A', 'Ab Minor': '1A',
-            
-            # F# Major / Eb Minor (6 Sharps / 6 Flats) -> 2
-            'F# Major': '2B', 'Gb Major': '2B', 'D# Minor': '2A', 'Eb Minor': '2A',
-            
-            # Db Major / Bb Minor (5 Flats / 7 Sharps) -> 3
-            'C# Major': '3B', 'Db Major': '3B', 'A# Minor': '3A', 'Bb Minor': '3A',
-            
-            # Ab Major / F Minor (4 Flats) -> 4
-            'G# Major': '4B', 'Ab Major': '4B', 'F Minor': '4A',
-            
-            # Eb Major / C Minor (3 Flats) -> 5
-            'D# Major': '5B', 'Eb Major': '5B', 'C Minor': '5A',
-            
-            # Bb Major / G Minor (2 Flats) -> 6
-            'A# Major': '6B', 'Bb Major': '6B', 'G Minor': '6A',
-            
-            # F Major / D Minor (1 Flat) -> 7
-            'F Major': '7B', 'D Minor': '7A',
-            
-            # C Major / A Minor (No Sharps/Flats) -> 8
-            'C Major': '8B', 'A Minor': '8A',
-            
-            # G Major / E Minor (1 Sharp) -> 9
-            'G Major': '9B', 'E Minor': '9A',
-            
-            # D Major / B Minor (2 Sharps) -> 10
-            'D Major': '10B', 'B Minor': '10A',
-            
-            # A Major / F# Minor (3 Sharps) -> 11
-            'A Major': '11B', 'F# Minor': '11A', 'Gb Minor': '11A',
-            
-            # E Major / C# Minor (4 Sharps) -> 12
-            'E Major': '12B', 'C# Minor': '12A', 'Db Minor': '12A'
-        }
-        
-        camelot_code = camelot_mapping.get(best_key, "Unknown")
-
-        return {
-            "filename": file.filename,
-            "detected_key": best_key,
-            "camelot_code": camelot_code
-        }
+        result = await _run_cached(_analyze_key_sync, data, suffix)
+        return _ORJSONResponse({"filename": file.filename, **result})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
-    
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
 
 @app.post("/analyze-structure")
 async def analyze_structure(file: UploadFile = File(...)):
     suffix = os.path.splitext(file.filename)[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_path = temp_file.name
+    data = await file.read()
 
     try:
-        # Load audio (downsample to 22050 for speed)
-        y, sr = librosa.load(temp_path, sr=22050)
-
-        # 1. Calculate RMS Energy (Loudness) and Spectral Contrast (Bass vs Treble)
-        # Hop length of 512 gives us roughly 43 analysis frames per second
-        hop_length = 512
-        
-        # Calculate Root Mean Square energy (overall volume)
-        rms = librosa.feature.rms(y=y, hop_length=hop_length)[0]
-        
-        # Calculate Spectral Centroid (brightness - helps detect drops)
-        cent = librosa.feature.spectral_centroid(y=y, sr=sr, hop_length=hop_length)[0]
-        
-        # Calculate Low-Frequency Energy (Bass)
-        S = np.abs(librosa.stft(y, hop_length=hop_length))
-        fft_freqs = librosa.fft_frequencies(sr=sr)
-        # Sum energy below 200Hz
-        bass_mask = fft_freqs < 200
-        bass_energy = np.sum(S[bass_mask, :], axis=0)
-
-        # Smooth the signals to remove jitter (like short drum hits)
-        # We use a median filter over ~1 second (43 frames)
-        smoothing_window = 43 
-        bass_smooth = scipy.ndimage.median_filter(bass_energy, size=smoothing_window)
-        rms_smooth = scipy.ndimage.median_filter(rms, size=smoothing_window)
-        
-        # Normalize signals to 0-1 range for easier thresholding
-        bass_norm = librosa.util.normalize(bass_smooth)
-        rms_norm = librosa.util.normalize(rms_smooth)
-
-        # 2. Detect "Drop" and "Breakdown" events
-        # Logic: 
-        # - High Bass + High RMS = Drop / Main Chorus
-        # - Low Bass + Medium/High RMS = Intro / Breakdown / Build-up
-        
-        # Convert frames to time
-        times = librosa.frames_to_time(np.arange(len(bass_norm)), sr=sr, hop_length=hop_length)
-        
-        # Create segments (simplified for response)
-        # We classify every 1 second chunk
-        duration = librosa.get_duration(y=y, sr=sr)
-        segments = []
-        
-        # Sample every 5 seconds to reduce output size
-        sample_rate_sec = 5
-        for t in range(0, int(duration), sample_rate_sec):
-            # Find frame index for this time
-            idx = librosa.time_to_frames(t, sr=sr, hop_length=hop_length)
-            if idx >= len(bass_norm): break
-            
-            b_val = bass_norm[idx]
-            r_val = rms_norm[idx]
-            
-            label = "Unknown"
-            if b_val > 0.6:
-                label = "High Energy (Drop/Chorus)"
-            elif b_val < 0.3 and r_val > 0.3:
-                label = "Breakdown/Build"
-            elif b_val < 0.2 and r_val < 0.2:
-                label = "Quiet/Intro/Outro"
-            else:
-                label = "Verse/Mid Energy"
-                
-            segments.append({
-                "time": t,
-                "label": label,
-                "bass_level": round(float(b_val), 2),
-                "energy_level": round(float(r_val), 2)
-            })
-
-        # 3. Find structural boundaries (Mix Points)
-        # Look for sudden large changes in bass energy
-        # Calculate derivative (rate of change)
-        bass_diff = np.diff(bass_norm)
-        # Find peaks in the derivative (sudden changes)
-        change_points_frames = np.where(np.abs(bass_diff) > 0.3)[0] # Threshold 0.3 implies 30% jump
-        change_points_times = librosa.frames_to_time(change_points_frames, sr=sr, hop_length=hop_length)
-        
-        # Filter changes that are too close together (keep only one every 10s)
-        filtered_changes = []
-        last_change = -100
-        for cp in change_points_times:
-            if cp - last_change > 10:
-                filtered_changes.append(round(float(cp), 2))
-                last_change = cp
-
-        return {
-            "filename": file.filename,
-            "duration_sec": round(duration, 2),
-            "mix_points_bass_change": filtered_changes,
-            "segments_5s_interval": segments
-        }
+        result = await _run_cached(_analyze_structure_sync, data, suffix)
+        return _ORJSONResponse({"filename": file.filename, **result})
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+
+@app.post("/analyze")
+async def analyze(
+    file: UploadFile = File(...),
+    start_bpm: float = Query(128.0, gt=0),
+    use_hpss: bool = False,
+):
+    # BPM, key and structure in one pass over a single decoded waveform
+    suffix = os.path.splitext(file.filename)[1]
+    data = await file.read()
+
+    try:
+        result = await _run_cached(
+            _analyze_all_sync, data, suffix,
+            start_bpm=start_bpm, use_hpss=use_hpss
+        )
+        return _ORJSONResponse({"filename": file.filename, **result})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
-    
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)